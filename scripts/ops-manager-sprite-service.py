@@ -4,25 +4,75 @@ import json
 import os
 import subprocess
 import tempfile
+import threading
+from collections import OrderedDict
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import parse_qs, urlparse
 
+try:  # optional accelerator; stdlib json remains the fallback
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Keep per-request scratch files in tmpfs when the host provides it.
+TMPFS_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Most loops seen by the in-memory idempotency cache; least recently used
+# loops are evicted (their maps stay on disk and reload on next access).
+IDEM_CACHE_MAX_LOOPS = 64
+
+# Cursor payload for /ops/events; only the string fields and offsets vary per
+# request, so skip the dict build + full json.dumps walk on the hot path.
+CURSOR_TMPL = (
+    '{"schemaVersion":"v1","repoPath":%s,"loopId":%s,"eventsFile":%s,'
+    '"eventLineOffset":%d,"eventLineCount":%d,"updatedAt":""}'
+)
+
+# ThreadingHTTPServer spawns a fresh thread per connection, so any per-thread
+# reuse scheme just leaks one scratch file per poll; create the cursor file
+# per request (a bare mkstemp in tmpfs, cheaper than the old
+# TemporaryDirectory) and unlink it when the request finishes.
+def make_cursor_file() -> Path:
+    fd, name = tempfile.mkstemp(suffix=".json", dir=TMPFS_DIR)
+    os.close(fd)
+    return Path(name)
+
+
+def discard_cursor_file(path: Path) -> None:
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def json_loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
 
 def json_load(path: Path, default: Any) -> Any:
     if not path.exists():
         return default
     try:
-        return json.loads(path.read_text())
+        return json_loads(path.read_bytes())
     except Exception:
         return default
 
 
 def json_dump_atomic(path: Path, value: Any) -> None:
     path.parent.mkdir(parents=True, exist_ok=True)
-    with tempfile.NamedTemporaryFile("w", delete=False, dir=str(path.parent)) as tmp:
-        tmp.write(json.dumps(value, separators=(",", ":")))
+    with tempfile.NamedTemporaryFile("wb", delete=False, dir=str(path.parent)) as tmp:
+        tmp.write(json_dumps(value))
         tmp_path = Path(tmp.name)
     tmp_path.replace(path)
 
@@ -33,6 +83,10 @@ def run_command(command: List[str]) -> Tuple[int, str, str]:
 
 
 def tail_text(value: str, max_lines: int = 40) -> str:
+    if not value:
+        return ""
+    # Short output still needs the blank-line/\r filter below -- a strip()
+    # shortcut would normalize short stderr differently from long stderr.
     lines = [line.rstrip("\r") for line in value.splitlines() if line.strip()]
     if not lines:
         return ""
@@ -43,7 +97,7 @@ def parse_last_json_line(value: str) -> Optional[Dict[str, Any]]:
     lines = [line.strip() for line in value.splitlines() if line.strip()]
     for line in reversed(lines):
         try:
-            parsed = json.loads(line)
+            parsed = json_loads(line)
             if isinstance(parsed, dict):
                 return parsed
         except Exception:
@@ -59,6 +113,12 @@ class ServiceConfig:
         self.snapshot_script = scripts_dir / "ops-manager-loop-run-snapshot.sh"
         self.poll_script = scripts_dir / "ops-manager-poll-events.sh"
         self.control_script = scripts_dir / "ops-manager-control.sh"
+        # String forms are used on every request when assembling argv; convert
+        # the resolved paths once instead of per call.
+        self.repo_str = str(repo)
+        self.snapshot_str = str(self.snapshot_script)
+        self.poll_str = str(self.poll_script)
+        self.control_str = str(self.control_script)
 
 
 class OpsHandler(BaseHTTPRequestHandler):
@@ -69,7 +129,7 @@ class OpsHandler(BaseHTTPRequestHandler):
         return self.server.cfg  # type: ignore[attr-defined]
 
     def _json(self, status: int, payload: Any) -> None:
-        body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+        body = json_dumps(payload)
         self.send_response(status)
         self.send_header("Content-Type", "application/json")
         self.send_header("Content-Length", str(len(body)))
@@ -130,7 +190,7 @@ class OpsHandler(BaseHTTPRequestHandler):
                 return
 
             trace_id = self._trace_id()
-            command = [str(self.cfg.snapshot_script), "--repo", str(self.cfg.repo), "--loop", loop_id]
+            command = [self.cfg.snapshot_str, "--repo", self.cfg.repo_str, "--loop", loop_id]
             if trace_id:
                 command += ["--trace-id", trace_id]
 
@@ -139,7 +199,7 @@ class OpsHandler(BaseHTTPRequestHandler):
                 self._error(502, "runtime_error", tail_text(err) or "snapshot command failed")
                 return
             try:
-                payload = json.loads(out)
+                payload = json_loads(out)
             except Exception:
                 self._error(502, "runtime_error", "snapshot output was not valid JSON")
                 return
@@ -164,27 +224,23 @@ class OpsHandler(BaseHTTPRequestHandler):
                 self._error(400, "invalid_request", str(exc))
                 return
 
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                cursor_file = Path(tmp_dir) / "cursor.json"
+            cursor_file = make_cursor_file()
+            try:
                 cursor_file.write_text(
-                    json.dumps(
-                        {
-                            "schemaVersion": "v1",
-                            "repoPath": str(self.cfg.repo),
-                            "loopId": loop_id,
-                            "eventsFile": f".superloop/loops/{loop_id}/events.jsonl",
-                            "eventLineOffset": cursor,
-                            "eventLineCount": cursor,
-                            "updatedAt": "",
-                        },
-                        separators=(",", ":"),
+                    CURSOR_TMPL
+                    % (
+                        json.dumps(self.cfg.repo_str),
+                        json.dumps(loop_id),
+                        json.dumps(f".superloop/loops/{loop_id}/events.jsonl"),
+                        cursor,
+                        cursor,
                     )
                 )
 
                 command = [
-                    str(self.cfg.poll_script),
+                    self.cfg.poll_str,
                     "--repo",
-                    str(self.cfg.repo),
+                    self.cfg.repo_str,
                     "--loop",
                     loop_id,
                     "--cursor-file",
@@ -195,46 +251,57 @@ class OpsHandler(BaseHTTPRequestHandler):
                 if max_events > 0:
                     command += ["--max-events", str(max_events)]
 
-                code, out, err = run_command(command)
+                # communicate() drains both pipes concurrently; reading
+                # stdout to EOF first would deadlock if the script filled
+                # the stderr pipe buffer mid-stream. The lines are
+                # batch-parsed below anyway, so nothing is lost by not
+                # consuming stdout incrementally.
+                proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                stdout_data, stderr_data = proc.communicate()
+                raw_lines: List[bytes] = [
+                    stripped
+                    for stripped in (line.strip() for line in stdout_data.splitlines())
+                    if stripped
+                ]
+                err = stderr_data.decode("utf-8", errors="replace") if stderr_data else ""
+                code = proc.returncode
                 if code != 0:
                     self._error(502, "runtime_error", tail_text(err) or "event poll command failed")
                     return
 
-                events: List[Dict[str, Any]] = []
-                for line in out.splitlines():
-                    stripped = line.strip()
-                    if not stripped:
-                        continue
-                    try:
-                        event_obj = json.loads(stripped)
-                    except Exception:
-                        self._error(502, "runtime_error", "event poll emitted invalid JSON")
-                        return
-                    if isinstance(event_obj, dict):
-                        events.append(event_obj)
+                # One decoder call over a synthesized array beats one parser
+                # startup per NDJSON line for bursty polls.
+                try:
+                    parsed = json_loads(b"[" + b",".join(raw_lines) + b"]") if raw_lines else []
+                except Exception:
+                    self._error(502, "runtime_error", "event poll emitted invalid JSON")
+                    return
+                events: List[Dict[str, Any]] = [item for item in parsed if isinstance(item, dict)]
 
                 cursor_json = json_load(cursor_file, {})
                 if not isinstance(cursor_json, dict):
                     cursor_json = {}
-
-                response = {
-                    "ok": True,
-                    "schemaVersion": "v1",
-                    "traceId": trace_id or None,
-                    "source": {
-                        "repoPath": str(self.cfg.repo),
-                        "loopId": loop_id,
-                    },
-                    "events": events,
-                    "cursor": {
-                        "eventLineOffset": cursor_json.get("eventLineOffset", cursor),
-                        "eventLineCount": cursor_json.get("eventLineCount", cursor),
-                        "updatedAt": cursor_json.get("updatedAt"),
-                    },
-                }
-                response = {k: v for k, v in response.items() if v is not None}
-                self._json(200, response)
-                return
+            finally:
+                discard_cursor_file(cursor_file)
+
+            response = {
+                "ok": True,
+                "schemaVersion": "v1",
+                "traceId": trace_id or None,
+                "source": {
+                    "repoPath": self.cfg.repo_str,
+                    "loopId": loop_id,
+                },
+                "events": events,
+                "cursor": {
+                    "eventLineOffset": cursor_json.get("eventLineOffset", cursor),
+                    "eventLineCount": cursor_json.get("eventLineCount", cursor),
+                    "updatedAt": cursor_json.get("updatedAt"),
+                },
+            }
+            response = {k: v for k, v in response.items() if v is not None}
+            self._json(200, response)
+            return
 
         self._error(404, "not_found", "endpoint not found")
 
@@ -251,7 +318,7 @@ class OpsHandler(BaseHTTPRequestHandler):
         raw = self.rfile.read(content_length) if content_length > 0 else b"{}"
 
         try:
-            payload = json.loads(raw.decode("utf-8"))
+            payload = json_loads(raw)
         except Exception:
             self._error(400, "invalid_json", "request body must be valid JSON")
             return
@@ -277,24 +344,39 @@ class OpsHandler(BaseHTTPRequestHandler):
 
         ops_dir = self.cfg.repo / ".superloop" / "ops-manager" / loop_id
         idem_file = ops_dir / "service-idempotency.json"
-        idem_map = json_load(idem_file, {})
-        if not isinstance(idem_map, dict):
-            idem_map = {}
-
-        if idempotency_key and idempotency_key in idem_map:
-            replayed_obj = idem_map[idempotency_key]
-            if isinstance(replayed_obj, dict):
-                replayed_obj = dict(replayed_obj)
-                replayed_obj["replayed"] = True
-                if trace_id and "traceId" not in replayed_obj:
-                    replayed_obj["traceId"] = trace_id
-                self._json(200, replayed_obj)
-                return
+        idem_cache: "OrderedDict[str, Dict[str, Any]]" = self.server.idem_cache  # type: ignore[attr-defined]
+        idem_lock: threading.Lock = self.server.idem_lock  # type: ignore[attr-defined]
+
+        idem_map: Optional[Dict[str, Any]] = None
+        replayed_obj = None
+        if idempotency_key:
+            with idem_lock:
+                idem_map = idem_cache.get(loop_id)
+                if idem_map is None:
+                    idem_map = json_load(idem_file, {})
+                    if not isinstance(idem_map, dict):
+                        idem_map = {}
+                    idem_cache[loop_id] = idem_map
+                    # LRU bound on loop count; evicted maps are already
+                    # persisted to their idempotency file and reload lazily.
+                    while len(idem_cache) > IDEM_CACHE_MAX_LOOPS:
+                        idem_cache.popitem(last=False)
+                else:
+                    idem_cache.move_to_end(loop_id)
+                replayed_obj = idem_map.get(idempotency_key)
+
+        if isinstance(replayed_obj, dict):
+            replayed_obj = dict(replayed_obj)
+            replayed_obj["replayed"] = True
+            if trace_id and "traceId" not in replayed_obj:
+                replayed_obj["traceId"] = trace_id
+            self._json(200, replayed_obj)
+            return
 
         command = [
-            str(self.cfg.control_script),
+            self.cfg.control_str,
             "--repo",
-            str(self.cfg.repo),
+            self.cfg.repo_str,
             "--loop",
             loop_id,
             "--intent",
@@ -325,8 +407,9 @@ class OpsHandler(BaseHTTPRequestHandler):
         response = {k: v for k, v in response.items() if v is not None}
 
         if idempotency_key:
-            idem_map[idempotency_key] = response
-            json_dump_atomic(idem_file, idem_map)
+            with idem_lock:
+                idem_map[idempotency_key] = response
+                json_dump_atomic(idem_file, idem_map)
 
         if code == 0:
             self._json(200, response)
@@ -369,6 +452,8 @@ def main() -> None:
 
     server = ThreadingHTTPServer((args.host, args.port), OpsHandler)
     server.cfg = cfg  # type: ignore[attr-defined]
+    server.idem_cache = OrderedDict()  # type: ignore[attr-defined]
+    server.idem_lock = threading.Lock()  # type: ignore[attr-defined]
     print(f"ops-manager sprite service listening on http://{args.host}:{args.port}")
     server.serve_forever()
 
@@ -12,7 +12,12 @@ from __future__ import annotations
 
 import argparse
 import ast
+import asyncio
+import bisect
+import concurrent.futures
+import functools
 import io
+import itertools
 import json
 import os
 import re
@@ -20,15 +25,21 @@ import subprocess
 import sys
 import tempfile
 import time
+from collections import ChainMap, deque
 from contextlib import redirect_stdout
 from dataclasses import dataclass, field
-from datetime import datetime, timezone
-from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:  # optional accelerator; stdlib json remains the fallback
+    import orjson
+except ImportError:
+    orjson = None
 
 MAX_CITATIONS = 120
 MAX_HIGHLIGHTS = 80
 MAX_SNIPPET_LEN = 220
 MAX_HISTORY_ITEMS = 8
+MAX_HISTORY_ENTRIES = 200
 MAX_PROMPT_FILE_LIST = 160
 MAX_SUBCALL_PROMPT_CHARS = 120_000
 
@@ -51,19 +62,139 @@ class ModelInvocationError(RLMSWorkerError):
 
 @dataclass
 class Document:
+    """Context file held as raw bytes; decoded views are built on demand.
+
+    The structural scan and read_file work directly on the byte payload, so
+    a document that is only scanned never pays for a full decode. text (and
+    anything derived from it) materializes lazily on first access.
+    """
+
     path: str
-    text: str
-    lines: List[str]
+    data: bytes
+    _text: Optional[str] = field(default=None, repr=False)
+    _lines: Optional[List[str]] = field(default=None, repr=False)
+    _line_starts: Optional[List[int]] = field(default=None, repr=False)
+    _text_line_starts: Optional[List[int]] = field(default=None, repr=False)
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode("utf-8", errors="ignore")
+        return self._text
+
+    @property
+    def lines(self) -> List[str]:
+        # Materialized on first line-based access; the structural scan and
+        # file summaries work on the byte payload alone.
+        if self._lines is None:
+            self._lines = self.text.splitlines()
+        return self._lines
+
+    @property
+    def line_starts(self) -> List[int]:
+        # Byte-offset table mapping line numbers to positions in data; built
+        # once per document and shared by the scan and read_file.
+        if self._line_starts is None:
+            self._line_starts = _line_start_offsets(self.data)
+        return self._line_starts
+
+    @property
+    def text_line_starts(self) -> List[int]:
+        # Character-offset twin of line_starts for code paths (grep) that
+        # search the decoded text; identical for pure-ASCII files but kept
+        # separate so multibyte content maps offsets correctly.
+        if self._text_line_starts is None:
+            self._text_line_starts = _line_start_offsets(self.text)
+        return self._text_line_starts
 
     @property
     def line_count(self) -> int:
-        return len(self.lines)
+        # Always derived from the byte offset table so the count is stable
+        # no matter which lazy view happens to be materialized first, and
+        # agrees with the numbering read_file and grep slice by.
+        return len(self.line_starts)
 
     @property
     def char_count(self) -> int:
+        # len(data) would be cheaper but counts bytes, not characters, and
+        # would silently change once text is decoded for a non-ASCII file.
         return len(self.text)
 
 
+class ContextMapping:
+    """path -> text mapping over the context documents.
+
+    Exposed to sandboxed code as CONTEXT, which used to be a plain dict, so
+    the full dict surface the validator whitelists has to keep working.
+    Decoding happens per document on first access instead of eagerly for the
+    whole context set; the mutating methods (pop, update, setdefault, clear)
+    materialize a real dict on first use and delegate to it from then on, so
+    code that mutates CONTEXT pays the eager decode every run paid before.
+    """
+
+    def __init__(self, docs_by_path: Dict[str, Document]) -> None:
+        self._docs = docs_by_path
+        self._materialized: Optional[Dict[str, str]] = None
+
+    def _mapping(self) -> Dict[str, str]:
+        if self._materialized is None:
+            self._materialized = {path: doc.text for path, doc in self._docs.items()}
+        return self._materialized
+
+    def __getitem__(self, key: Any) -> str:
+        if self._materialized is not None:
+            return self._materialized[str(key)]
+        return self._docs[str(key)].text
+
+    def __contains__(self, key: Any) -> bool:
+        if self._materialized is not None:
+            return str(key) in self._materialized
+        return str(key) in self._docs
+
+    def __len__(self) -> int:
+        return len(self._materialized if self._materialized is not None else self._docs)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._materialized if self._materialized is not None else self._docs)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        if self._materialized is not None:
+            return self._materialized.get(str(key), default)
+        doc = self._docs.get(str(key))
+        return default if doc is None else doc.text
+
+    # Lists rather than generators: generated code iterates these more than
+    # once, and a second pass over an exhausted generator silently yields
+    # nothing.
+    def keys(self) -> List[str]:
+        return list(self)
+
+    def values(self) -> List[str]:
+        if self._materialized is not None:
+            return list(self._materialized.values())
+        return [doc.text for doc in self._docs.values()]
+
+    def items(self) -> List[Tuple[str, str]]:
+        if self._materialized is not None:
+            return list(self._materialized.items())
+        return [(path, doc.text) for path, doc in self._docs.items()]
+
+    def copy(self) -> Dict[str, str]:
+        return dict(self.items())
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        return self._mapping().pop(str(key), *default)
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        return self._mapping().setdefault(str(key), default)
+
+    def update(self, *args: Any, **kwargs: Any) -> None:
+        self._mapping().update(*args, **kwargs)
+
+    def clear(self) -> None:
+        self._materialized = {}
+
+
 @dataclass
 class CliConfig:
     command: List[str]
@@ -81,7 +212,20 @@ class ExecutionState:
     max_subcalls: int
     step_count: int = 0
     subcall_count: int = 0
-    history: List[Dict[str, Any]] = field(default_factory=list)
+    # Bounded ring buffer: appends evict the oldest entry past the cap,
+    # so no per-step slice copies are needed.
+    history: Deque[Dict[str, Any]] = field(
+        default_factory=lambda: deque(maxlen=MAX_HISTORY_ENTRIES)
+    )
+    # Last few entries mirrored for the emitted trace and prompt summary,
+    # avoiding a tail slice of history on every exit.
+    trace_tail: Deque[Dict[str, Any]] = field(
+        default_factory=lambda: deque(maxlen=MAX_HISTORY_ITEMS)
+    )
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        self.history.append(entry)
+        self.trace_tail.append(entry)
 
     def elapsed_seconds(self) -> float:
         return time.monotonic() - self.started_at_monotonic
@@ -94,7 +238,11 @@ class ExecutionState:
         self.step_count += 1
         if self.max_steps > 0 and self.step_count > self.max_steps:
             raise LimitError(f"step limit exceeded ({self.max_steps})")
-        self.check_timeout()
+        # Amortize the monotonic-clock read; the wall clock is still checked
+        # before every CLI invocation (remaining_timeout) and sandbox helper
+        # call (check_timeout), so timeout enforcement granularity is kept.
+        if (self.step_count & 1023) == 0:
+            self.check_timeout()
 
     def next_subcall(self, depth: int) -> None:
         if depth < 1:
@@ -229,6 +377,149 @@ PATTERNS: List[Tuple[str, re.Pattern[str]]] = [
     ("error", re.compile(r"\b(?:error|fail|exception)\b", re.IGNORECASE)),
 ]
 
+
+def _build_master_pattern(
+    patterns: Sequence[Tuple[str, re.Pattern[str]]], flags: int = 0
+) -> re.Pattern[str]:
+    branches: List[str] = []
+    for name, pattern in patterns:
+        # Under MULTILINE over whole documents \s eats newlines, anchoring
+        # matches at blank lines above a declaration and letting trailing
+        # "\s*\(" spill onto the next line. The source patterns were written
+        # for per-line search, so their line-local equivalent is intra-line
+        # whitespace only.
+        body = pattern.pattern.replace(r"\s", "[ \t]")
+        if pattern.flags & re.IGNORECASE:
+            body = f"(?i:{body})"
+        # Zero-width branches: a consuming alternation would swallow the span
+        # of one signal while skipping another that starts inside it (e.g.
+        # "def error():" counts both python_def and error per line in the
+        # per-line scan). Lookaheads keep every branch's hit visible; the
+        # (line, signal) dedupe in the scanner caps each at once per line.
+        branches.append(f"(?=(?P<{name}>{body}))")
+    return re.compile("|".join(branches), flags)
+
+
+SIGNAL_NAMES: Tuple[str, ...] = tuple(name for name, _ in PATTERNS)
+SIGNAL_INDEX: Dict[str, int] = {name: idx for idx, name in enumerate(SIGNAL_NAMES)}
+
+# One alternation regex over all structural patterns; each match's lastgroup
+# names the signal. Compiled with MULTILINE so a single C-level finditer over
+# the whole document replaces the per-line, per-pattern Python loop.
+MASTER_PATTERN: re.Pattern[str] = _build_master_pattern(PATTERNS, re.MULTILINE)
+
+# Language-specific signal subsets: Python sources can never match the JS
+# declaration patterns and vice versa, so scan only the branches that can
+# fire for the file's extension. Unknown extensions keep the full set.
+_PY_SIGNALS: Tuple[str, ...] = ("class", "python_def", "test", "todo", "error")
+_JS_SIGNALS: Tuple[str, ...] = (
+    "class",
+    "function",
+    "arrow_function",
+    "test",
+    "todo",
+    "error",
+)
+SIGNALS_BY_EXT: Dict[str, Tuple[str, ...]] = {
+    ".py": _PY_SIGNALS,
+    ".pyi": _PY_SIGNALS,
+    ".js": _JS_SIGNALS,
+    ".jsx": _JS_SIGNALS,
+    ".mjs": _JS_SIGNALS,
+    ".cjs": _JS_SIGNALS,
+    ".ts": _JS_SIGNALS,
+    ".tsx": _JS_SIGNALS,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _master_pattern_for(names: Tuple[str, ...]) -> re.Pattern[str]:
+    if names == SIGNAL_NAMES:
+        return MASTER_PATTERN
+    subset = [(name, pattern) for name, pattern in PATTERNS if name in names]
+    return _build_master_pattern(subset, re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def _master_pattern_bytes_for(names: Tuple[str, ...]) -> re.Pattern[bytes]:
+    # Bytes twin of _master_pattern_for; the pattern source is pure ASCII,
+    # so the structural scan can run over raw document bytes without a
+    # decode pass.
+    return re.compile(_master_pattern_for(names).pattern.encode("ascii"), re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=None)
+def _scanner_for(names: Tuple[str, ...]):
+    """Build a scan closure specialized for one pattern subset.
+
+    Binding the pattern's finditer, bisect, and the signal-index table as
+    closure locals removes the global/attribute lookups from the per-match
+    loop without resorting to exec()-based code generation, which has no
+    place in a sandboxing worker.
+    """
+    finditer = _master_pattern_bytes_for(names).finditer
+    bisect_right = bisect.bisect_right
+    signal_index = SIGNAL_INDEX
+    max_citations = MAX_CITATIONS
+
+    def scan(
+        path: str,
+        data: bytes,
+        line_starts: List[int],
+        counts: List[int],
+        citations: List[Dict[str, Any]],
+        citations_full: bool,
+    ) -> bool:
+        matched: set[Tuple[int, str]] = set()
+        for match in finditer(data):
+            signal = match.lastgroup
+            if signal is None:
+                continue
+            line_no = bisect_right(line_starts, match.start())
+            key = (line_no, signal)
+            if key in matched:
+                continue
+            matched.add(key)
+            counts[signal_index[signal]] += 1
+            if not citations_full:
+                start = line_starts[line_no - 1]
+                end = data.find(b"\n", start)
+                if end == -1:
+                    end = len(data)
+                citations.append(
+                    {
+                        "path": path,
+                        "start_line": line_no,
+                        "end_line": line_no,
+                        "signal": signal,
+                        "snippet": compact_text(
+                            data[start:end].decode("utf-8", errors="ignore")
+                        ),
+                    }
+                )
+                citations_full = len(citations) >= max_citations
+        return citations_full
+
+    return scan
+
+
+def _line_start_offsets(source: Any) -> List[int]:
+    """Offsets of every line start, aligned with splitlines numbering.
+
+    Works on str (character offsets) and bytes (byte offsets) alike.
+    """
+    starts: List[int] = []
+    if not source:
+        return starts
+    newline = "\n" if isinstance(source, str) else b"\n"
+    starts.append(0)
+    pos = source.find(newline)
+    while pos != -1 and pos + 1 < len(source):
+        starts.append(pos + 1)
+        pos = source.find(newline, pos + 1)
+    return starts
+
+
 SAFE_METHOD_CALLS: set[str] = {
     # list-like
     "append",
@@ -271,9 +562,56 @@ SAFE_EXCEPTION_HANDLER_TYPES: set[str] = {
     "IndexError",
 }
 
+# Names bound into every sandbox; fixed for the life of the process so code
+# validation can be a pure function of the code string.
+SANDBOX_BINDING_NAMES: frozenset[str] = frozenset(
+    {
+        "CONTEXT",
+        "list_files",
+        "read_file",
+        "grep",
+        "slice_text",
+        "append_highlight",
+        "add_citation",
+        "sub_rlm",
+        "sub_rlm_batch",
+        "set_final",
+    }
+)
+
+
+def _dumps(value: Any) -> bytes:
+    if orjson is not None:
+        # final comes from sandboxed code and may use non-str dict keys,
+        # which stdlib json coerces; OPT_NON_STR_KEYS keeps the contract
+        # identical whether or not the accelerator is installed.
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=True).encode("ascii")
+
+
+def _emit_json(value: Any) -> None:
+    """Write one compact JSON line to stdout without building a giant str."""
+    if orjson is not None:
+        # orjson already hands back one bytes object, so the whole line can
+        # bypass the io stack in a single syscall. Flush first so anything
+        # still sitting in the text/buffer layers keeps its ordering.
+        # OPT_NON_STR_KEYS: see _dumps.
+        sys.stdout.flush()
+        os.write(1, orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS) + b"\n")
+        return
+    # iterencode streams the payload in chunks, keeping peak memory flat
+    # for results with many citations/file summaries.
+    out = sys.stdout.buffer
+    for chunk in json.JSONEncoder(separators=(",", ":")).iterencode(value):
+        out.write(chunk.encode("ascii"))
+    out.write(b"\n")
+    # The consumer reads this line as soon as the worker exits; flush so the
+    # payload is not left sitting in the buffer if teardown is interrupted.
+    out.flush()
+
 
 def utc_now() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
 
 
 def parse_bool(value: str) -> bool:
@@ -286,8 +624,38 @@ def estimate_tokens(char_count: int) -> int:
     return (char_count + 3) // 4
 
 
+_WS = re.compile(r"\s+")
+
+_NON_WS = re.compile(r"\S+")
+
+_GREP_FLAG_MAP = {"i": re.IGNORECASE, "m": re.MULTILINE}
+
+
+@functools.lru_cache(maxsize=256)
+def _compile_grep(pattern: str, flag_value: int) -> re.Pattern[str]:
+    # MULTILINE lets ^ match at the start of each (pos, endpos) line window
+    # during grep, since pos past a newline is not a string start. Memoized
+    # because models tend to reissue the same (pattern, flags) pair across
+    # iterations.
+    return re.compile(pattern, flag_value | re.MULTILINE)
+
+
 def compact_text(text: str, max_len: int = MAX_SNIPPET_LEN) -> str:
-    line = " ".join(str(text).strip().split())
+    s = text if type(text) is str else str(text)
+    if len(s) > max_len * 4:
+        # Whitespace collapses below, so a fixed-width pre-cut can delete
+        # content hiding past a whitespace-heavy prefix. Walk non-whitespace
+        # runs until they provably fill the collapsed budget and cut there;
+        # for dense text this stops after roughly max_len characters.
+        collapsed_len = -1
+        for match in _NON_WS.finditer(s):
+            collapsed_len += match.end() - match.start() + 1
+            # Strictly past the budget: stopping at exactly max_len would
+            # skip the ellipsis the full collapse would have added.
+            if collapsed_len > max_len:
+                s = s[: match.end()]
+                break
+    line = _WS.sub(" ", s).strip()
     if len(line) <= max_len:
         return line
     return line[: max_len - 3] + "..."
@@ -297,8 +665,9 @@ def load_metadata(metadata_file: str) -> Dict[str, Any]:
     if not metadata_file or not os.path.exists(metadata_file):
         return {}
     try:
-        with open(metadata_file, "r", encoding="utf-8") as f:
-            data = json.load(f)
+        with open(metadata_file, "rb") as f:
+            raw = f.read()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
         if isinstance(data, dict):
             return data
     except Exception:
@@ -306,32 +675,52 @@ def load_metadata(metadata_file: str) -> Dict[str, Any]:
     return {}
 
 
+def _read_doc(candidate: str, repo: str) -> Optional[Document]:
+    # One pool task per file: the isfile stat and the read both release the
+    # GIL, and fusing them avoids a synchronization barrier between a stat
+    # pass and a read pass.
+    if not os.path.isfile(candidate):
+        return None
+    try:
+        with open(candidate, "rb") as f:
+            data = f.read()
+    except Exception:
+        data = b""
+    return Document(path=to_rel(candidate, repo), data=data)
+
+
 def load_context_files(context_file_list: str, repo: str) -> List[Document]:
     docs: List[Document] = []
-    seen: set[str] = set()
     if not os.path.exists(context_file_list):
         return docs
 
     with open(context_file_list, "r", encoding="utf-8", errors="ignore") as f:
-        for raw in f:
-            candidate = raw.strip()
-            if not candidate or candidate in seen:
-                continue
-            seen.add(candidate)
-            if not os.path.isfile(candidate):
-                continue
+        stripped = (raw.strip() for raw in f)
+        unique = list(dict.fromkeys(line for line in stripped if line))
+    if not unique:
+        return docs
 
-            rel = to_rel(candidate, repo)
-            try:
-                with open(candidate, "r", encoding="utf-8", errors="ignore") as cf:
-                    text = cf.read()
-            except Exception:
-                text = ""
-            docs.append(Document(path=rel, text=text, lines=text.splitlines()))
+    # map() preserves submit order, so the resulting doc order stays
+    # deterministic regardless of which reads finish first.
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(32, len(unique))
+    ) as pool:
+        loaded = pool.map(functools.partial(_read_doc, repo=repo), unique)
+        docs.extend(doc for doc in loaded if doc is not None)
     return docs
 
 
+@functools.lru_cache(maxsize=8)
+def _repo_prefix(repo: str) -> str:
+    return os.path.abspath(repo) + os.sep
+
+
 def to_rel(path: str, repo: str) -> str:
+    # Absolute paths under the repo root -- the common case for context file
+    # lists -- reduce to a prefix strip with no syscalls.
+    prefix = _repo_prefix(repo)
+    if path.startswith(prefix):
+        return path[len(prefix):]
     try:
         rel = os.path.relpath(path, repo)
         if not rel.startswith(".."):
@@ -341,21 +730,27 @@ def to_rel(path: str, repo: str) -> str:
     return path
 
 
-def parse_json_string_array(name: str, raw: str) -> List[str]:
-    if raw is None or raw == "":
-        return []
+@functools.lru_cache(maxsize=64)
+def _parse_json_string_array(name: str, raw: str) -> Tuple[str, ...]:
+    # Parent drivers invoke the worker with identical --*-json blobs across
+    # iterations; caching collapses repeat parses to a dict lookup. Returns
+    # an immutable tuple so cached results cannot alias caller mutations.
     try:
         value = json.loads(raw)
     except Exception as exc:  # pragma: no cover - defensive
         raise RLMSWorkerError(f"{name} must be valid JSON array: {exc}")
     if not isinstance(value, list):
         raise RLMSWorkerError(f"{name} must be a JSON array")
-    out: List[str] = []
     for idx, item in enumerate(value):
         if not isinstance(item, str):
             raise RLMSWorkerError(f"{name}[{idx}] must be a string")
-        out.append(item)
-    return out
+    return tuple(value)
+
+
+def parse_json_string_array(name: str, raw: str) -> List[str]:
+    if raw is None or raw == "":
+        return []
+    return list(_parse_json_string_array(name, raw))
 
 
 def parse_prompt_mode(raw: str, default: str = "stdin") -> str:
@@ -372,6 +767,35 @@ def expand_placeholders(arg: str, repo: str, prompt_file: str, last_message_file
     return out
 
 
+def _materialize_prompt_files(cli: CliConfig, prompt: str) -> Tuple[str, str]:
+    """Create only the temp files the command line actually references.
+
+    In the common stdin-prompt configuration neither placeholder appears, so
+    no temp files (and no unlink syscalls later) are needed at all.
+    """
+    parts = cli.command + cli.args
+    prompt_path = ""
+    last_message_path = ""
+    if any("{prompt_file}" in part for part in parts):
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as prompt_file:
+            prompt_file.write(prompt)
+            prompt_path = prompt_file.name
+    if any("{last_message_file}" in part for part in parts):
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as msg_file:
+            last_message_path = msg_file.name
+    return prompt_path, last_message_path
+
+
+def _cleanup_prompt_files(*paths: str) -> None:
+    for path in paths:
+        if not path:
+            continue
+        try:
+            os.unlink(path)
+        except Exception:
+            pass
+
+
 def invoke_cli(
     cli: CliConfig,
     prompt: str,
@@ -385,12 +809,7 @@ def invoke_cli(
     prompt_path = ""
     last_message_path = ""
     try:
-        with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as prompt_file:
-            prompt_file.write(prompt)
-            prompt_path = prompt_file.name
-
-        with tempfile.NamedTemporaryFile("w", encoding="utf-8", delete=False) as msg_file:
-            last_message_path = msg_file.name
+        prompt_path, last_message_path = _materialize_prompt_files(cli, prompt)
 
         expanded: List[str] = []
         for part in cli.command:
@@ -426,14 +845,76 @@ def invoke_cli(
     except Exception as exc:  # pragma: no cover - defensive
         raise ModelInvocationError(f"{cli.label}: command failed: {exc}") from exc
     finally:
+        _cleanup_prompt_files(prompt_path, last_message_path)
+
+
+# Ceiling on concurrently running subcall processes in sub_rlm_batch.
+MAX_PARALLEL_SUBCALLS = 4
+
+
+async def _invoke_cli_async(
+    cli: CliConfig,
+    prompt: str,
+    repo: str,
+    timeout_seconds: Optional[float],
+) -> Dict[str, Any]:
+    """Async twin of invoke_cli for concurrent subcall dispatch."""
+    if not cli.command:
+        raise ModelInvocationError(f"{cli.label}: command is empty")
+
+    start = time.monotonic()
+    prompt_path = ""
+    last_message_path = ""
+    try:
+        prompt_path, last_message_path = _materialize_prompt_files(cli, prompt)
+
+        expanded: List[str] = []
+        for part in cli.command:
+            expanded.append(expand_placeholders(part, repo, prompt_path, last_message_path))
+        for part in cli.args:
+            expanded.append(expand_placeholders(part, repo, prompt_path, last_message_path))
+
+        use_stdin = cli.prompt_mode == "stdin"
+        proc = await asyncio.create_subprocess_exec(
+            *expanded,
+            cwd=repo,
+            stdin=asyncio.subprocess.PIPE if use_stdin else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
         try:
-            os.unlink(prompt_path)
-        except Exception:
-            pass
-        try:
-            os.unlink(last_message_path)
-        except Exception:
-            pass
+            stdout, stderr = await asyncio.wait_for(
+                proc.communicate(input=prompt.encode("utf-8") if use_stdin else None),
+                timeout=timeout_seconds,
+            )
+        except asyncio.TimeoutError as exc:
+            proc.kill()
+            # Reap the killed child before the loop closes, or it lingers as
+            # a zombie and the transport warns about a closed event loop.
+            await proc.wait()
+            raise ModelInvocationError(
+                f"{cli.label}: command timed out after {int(timeout_seconds or 0)}s"
+            ) from exc
+        duration_ms = int((time.monotonic() - start) * 1000)
+        return {
+            "ok": proc.returncode == 0,
+            "returncode": int(proc.returncode or 0),
+            "stdout": (stdout or b"").decode("utf-8", errors="replace"),
+            "stderr": (stderr or b"").decode("utf-8", errors="replace"),
+            "duration_ms": duration_ms,
+            "command": expanded,
+        }
+    except ModelInvocationError:
+        raise
+    except FileNotFoundError as exc:
+        raise ModelInvocationError(f"{cli.label}: command not found: {cli.command[0]}") from exc
+    except Exception as exc:  # pragma: no cover - defensive
+        raise ModelInvocationError(f"{cli.label}: command failed: {exc}") from exc
+    finally:
+        _cleanup_prompt_files(prompt_path, last_message_path)
+
+
+_FENCE_RE = re.compile(r"```(?:python)?\s*(.*?)```", re.IGNORECASE | re.DOTALL)
 
 
 def extract_python_code(text: str) -> str:
@@ -441,13 +922,14 @@ def extract_python_code(text: str) -> str:
     if not raw:
         raise RLMSWorkerError("root model returned empty response")
 
-    fenced = re.findall(r"```(?:python)?\s*(.*?)```", raw, flags=re.IGNORECASE | re.DOTALL)
-    if fenced:
-        # Favor the longest fenced block.
-        block = sorted(fenced, key=len, reverse=True)[0].strip()
-        if block:
-            return block
-    return raw
+    # Favor the longest fenced block; track it in one pass instead of
+    # materializing and sorting every block.
+    best = ""
+    for match in _FENCE_RE.finditer(raw):
+        block = match.group(1).strip()
+        if len(block) > len(best):
+            best = block
+    return best or raw
 
 
 def normalize_signal(value: Any) -> str:
@@ -486,45 +968,79 @@ def normalize_citation(raw: Any) -> Optional[Dict[str, Any]]:
 
 
 def dedupe_citations(items: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    seen: set[Tuple[str, int, int, str, str]] = set()
-    out: List[Dict[str, Any]] = []
+    # Snippets are deterministic given (path, lines, signal), so they add
+    # nothing to the key while dominating its hashing cost.
+    seen: Dict[Tuple[str, int, int, str], Dict[str, Any]] = {}
     for item in items:
         key = (
             item.get("path", ""),
             int(item.get("start_line", 1)),
             int(item.get("end_line", 1)),
             item.get("signal", "reference"),
-            item.get("snippet", ""),
         )
-        if key in seen:
-            continue
-        seen.add(key)
-        out.append(item)
-        if len(out) >= MAX_CITATIONS:
-            break
-    return out
+        if key not in seen:
+            seen[key] = item
+            if len(seen) >= MAX_CITATIONS:
+                break
+    return list(seen.values())
+
+
+# Below this many documents the fork/pickle overhead of a process pool
+# outweighs the scan itself.
+MIN_PARALLEL_SCAN_DOCS = 4
+
+
+def _scan_document(item: Tuple[str, bytes]) -> Tuple[List[int], List[Dict[str, Any]]]:
+    """Scan one (path, data) pair; module-level so it pickles for pool workers."""
+    path, data = item
+    counts = [0] * len(SIGNAL_NAMES)
+    citations: List[Dict[str, Any]] = []
+    ext = os.path.splitext(path)[1].lower()
+    scan = _scanner_for(SIGNALS_BY_EXT.get(ext, SIGNAL_NAMES))
+    scan(path, data, _line_start_offsets(data), counts, citations, False)
+    return counts, citations
 
 
 def collect_structural_signals(docs: Sequence[Document]) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
-    totals = {name: 0 for name, _ in PATTERNS}
+    counts = [0] * len(SIGNAL_NAMES)
     citations: List[Dict[str, Any]] = []
+    citations_full = False
+
+    # Empty documents cannot contribute signals; drop them before paying for
+    # pool dispatch or line-offset tables.
+    docs = [doc for doc in docs if doc.data]
+
+    if len(docs) >= MIN_PARALLEL_SCAN_DOCS:
+        results: Optional[List[Tuple[List[int], List[Dict[str, Any]]]]]
+        try:
+            with concurrent.futures.ProcessPoolExecutor() as pool:
+                results = list(
+                    pool.map(
+                        _scan_document,
+                        [(doc.path, doc.data) for doc in docs],
+                        chunksize=8,
+                    )
+                )
+        except Exception:
+            # Process pools can be unavailable (restricted environments);
+            # fall through to the serial scan.
+            results = None
+        if results is not None:
+            for doc_counts, doc_citations in results:
+                for idx, value in enumerate(doc_counts):
+                    counts[idx] += value
+                if not citations_full:
+                    citations.extend(doc_citations[: MAX_CITATIONS - len(citations)])
+                    citations_full = len(citations) >= MAX_CITATIONS
+            return dict(zip(SIGNAL_NAMES, counts)), citations
 
     for doc in docs:
-        for idx, line in enumerate(doc.lines, start=1):
-            for signal, pattern in PATTERNS:
-                if pattern.search(line):
-                    totals[signal] += 1
-                    if len(citations) < MAX_CITATIONS:
-                        citations.append(
-                            {
-                                "path": doc.path,
-                                "start_line": idx,
-                                "end_line": idx,
-                                "signal": signal,
-                                "snippet": compact_text(line),
-                            }
-                        )
-    return totals, citations
+        ext = os.path.splitext(doc.path)[1].lower()
+        scan = _scanner_for(SIGNALS_BY_EXT.get(ext, SIGNAL_NAMES))
+        citations_full = scan(
+            doc.path, doc.data, doc.line_starts, counts, citations, citations_full
+        )
+    return dict(zip(SIGNAL_NAMES, counts)), citations
 
 
 def build_file_summaries(docs: Sequence[Document]) -> List[Dict[str, Any]]:
@@ -540,18 +1056,18 @@ def build_file_summaries(docs: Sequence[Document]) -> List[Dict[str, Any]]:
     return out
 
 
-def summarize_history(history: Sequence[Dict[str, Any]]) -> str:
+def summarize_history(history: "Deque[Dict[str, Any]]") -> str:
     if not history:
         return "(none)"
     rows: List[str] = []
-    for item in history[-MAX_HISTORY_ITEMS:]:
+    for item in history:
         rows.append(
             f"step={item.get('step')} rc={item.get('returncode')} code={compact_text(item.get('code_preview', ''), 120)} stdout={compact_text(item.get('stdout_preview', ''), 120)}"
         )
     return "\n".join(rows)
 
 
-def build_root_prompt(
+def build_root_prompt_prefix(
     *,
     role: str,
     loop_id: str,
@@ -559,7 +1075,13 @@ def build_root_prompt(
     docs: Sequence[Document],
     metadata: Dict[str, Any],
     state: ExecutionState,
-) -> str:
+) -> Tuple[str, str]:
+    """Build the invariant prompt segments once, before the step loop.
+
+    Everything except the per-step status block and the execution history is
+    fixed for the run -- including the file index and metadata JSON, which
+    are the expensive parts -- so build_root_prompt only fills the gaps.
+    """
     files = docs[:MAX_PROMPT_FILE_LIST]
     file_lines = "\n".join(
         f"- {doc.path} ({doc.line_count} lines, {estimate_tokens(doc.char_count)} est tokens)"
@@ -568,18 +1090,17 @@ def build_root_prompt(
     if len(docs) > MAX_PROMPT_FILE_LIST:
         file_lines += f"\n- ... ({len(docs) - MAX_PROMPT_FILE_LIST} more files omitted)"
 
-    metadata_line = json.dumps(metadata or {}, ensure_ascii=True)
+    metadata_line = _dumps(metadata or {}).decode("utf-8")
 
-    return (
+    head = (
         "You are the root model in a recursive language model scaffold.\n"
         "Output only Python code. No prose.\n"
         "\n"
         f"Loop: {loop_id}\n"
         f"Role: {role}\n"
         f"Iteration: {iteration}\n"
-        f"Step: {state.step_count}/{state.max_steps}\n"
-        f"Elapsed seconds: {state.elapsed_seconds():.2f}\n"
-        f"Subcalls used: {state.subcall_count}/{state.max_subcalls}\n"
+    )
+    body = (
         f"Max subcall depth: {state.max_depth}\n"
         "\n"
         "Context is external; use helper functions to inspect it.\n"
@@ -591,6 +1112,7 @@ def build_root_prompt(
         "- append_highlight(text)\n"
         "- add_citation(path, start_line, end_line, signal='reference', snippet='')\n"
         "- sub_rlm(prompt, depth=1) -> str\n"
+        "- sub_rlm_batch(prompts, depth=1) -> list[str]  # runs subcalls concurrently\n"
         "- set_final(value)  # call this when done\n"
         "\n"
         "Rules:\n"
@@ -606,7 +1128,19 @@ def build_root_prompt(
         f"{file_lines if file_lines else '(no files)'}\n"
         "\n"
         "Recent execution history:\n"
-        f"{summarize_history(state.history)}\n"
+    )
+    return head, body
+
+
+def build_root_prompt(*, prefix: Tuple[str, str], state: ExecutionState) -> str:
+    head, body = prefix
+    return (
+        head
+        + f"Step: {state.step_count}/{state.max_steps}\n"
+        + f"Elapsed seconds: {state.elapsed_seconds():.2f}\n"
+        + f"Subcalls used: {state.subcall_count}/{state.max_subcalls}\n"
+        + body
+        + f"{summarize_history(state.trace_tail)}\n"
     )
 
 
@@ -625,11 +1159,12 @@ class SandboxEnvironment:
         self.repo = repo
 
         self.highlights: List[str] = []
+        self._highlight_set: set[str] = set()
         self.citations: List[Dict[str, Any]] = []
         self.final_value: Any = None
 
         self._bindings: Dict[str, Any] = {
-            "CONTEXT": {doc.path: doc.text for doc in docs},
+            "CONTEXT": ContextMapping(self.docs_by_path),
             "list_files": self.list_files,
             "read_file": self.read_file,
             "grep": self.grep,
@@ -637,13 +1172,13 @@ class SandboxEnvironment:
             "append_highlight": self.append_highlight,
             "add_citation": self.add_citation,
             "sub_rlm": self.sub_rlm,
+            "sub_rlm_batch": self.sub_rlm_batch,
             "set_final": self.set_final,
         }
-        self.locals: Dict[str, Any] = dict(self._bindings)
-
-    def _refresh_bindings(self) -> None:
-        for name, value in self._bindings.items():
-            self.locals[name] = value
+        # User-defined names land in user_locals; helper lookups fall through
+        # to _bindings without copying the binding table on every step.
+        self.user_locals: Dict[str, Any] = {}
+        self.locals: ChainMap = ChainMap(self.user_locals, self._bindings)
 
     def list_files(self) -> List[str]:
         self.state.check_timeout()
@@ -667,9 +1202,26 @@ class SandboxEnvironment:
                 end = max(start, int(end_line))
             except Exception:
                 end = doc.line_count
-        if start > doc.line_count:
+        line_starts = doc.line_starts
+        count = len(line_starts)
+        if start > count:
             return ""
-        return "\n".join(doc.lines[start - 1 : end])
+        end = min(end, count)
+        data = doc.data
+        # Slice each requested line between consecutive offsets, stripping
+        # its own terminator. splitlines() on the joined window would drop a
+        # trailing empty line from the result.
+        parts: List[bytes] = []
+        for idx in range(start - 1, end):
+            begin = line_starts[idx]
+            stop = line_starts[idx + 1] - 1 if idx + 1 < count else len(data)
+            if stop > begin and data[stop - 1 : stop] == b"\n":
+                stop -= 1
+            if stop > begin and data[stop - 1 : stop] == b"\r":
+                stop -= 1
+            parts.append(data[begin:stop])
+        # Decode only the requested window, not the whole document.
+        return b"\n".join(parts).decode("utf-8", errors="ignore")
 
     def grep(
         self,
@@ -686,14 +1238,13 @@ class SandboxEnvironment:
             limit = 80
         limit = min(limit, 500)
 
+        flag_text = str(flags)
         flag_value = 0
-        if "i" in str(flags):
-            flag_value |= re.IGNORECASE
-        if "m" in str(flags):
-            flag_value |= re.MULTILINE
+        for char in flag_text:
+            flag_value |= _GREP_FLAG_MAP.get(char, 0)
 
         try:
-            regex = re.compile(str(pattern), flag_value)
+            regex = _compile_grep(str(pattern), flag_value)
         except re.error as exc:
             raise SandboxViolation(f"invalid regex: {exc}") from exc
 
@@ -707,19 +1258,41 @@ class SandboxEnvironment:
 
         out: List[Dict[str, Any]] = []
         for rel_path, doc in targets:
-            for line_no, line in enumerate(doc.lines, start=1):
-                if regex.search(line):
-                    out.append(
-                        {
-                            "path": rel_path,
-                            "start_line": line_no,
-                            "end_line": line_no,
-                            "signal": "regex_match",
-                            "snippet": compact_text(line),
-                        }
-                    )
-                    if len(out) >= limit:
-                        return out
+            text = doc.text
+            line_starts = doc.text_line_starts
+            count = len(line_starts)
+            # Search each physical line as a (pos, endpos) window over the
+            # decoded text. A whole-text finditer pass misattributes matches:
+            # a mid-pattern \s can swallow the newline (reporting the hit one
+            # line early with the wrong snippet) and zero-width patterns match
+            # at the phantom position past a trailing newline. Windows keep
+            # the per-line semantics without allocating a string per line.
+            for idx in range(count):
+                start = line_starts[idx]
+                if idx + 1 < count:
+                    end = line_starts[idx + 1] - 1
+                else:
+                    # The offset table has no phantom entry past a trailing
+                    # newline, so trim it here or zero-width patterns would
+                    # match at the position after it.
+                    end = len(text)
+                    if end > start and text[end - 1] == "\n":
+                        end -= 1
+                if end > start and text[end - 1] == "\r":
+                    end -= 1
+                if regex.search(text, start, end) is None:
+                    continue
+                out.append(
+                    {
+                        "path": rel_path,
+                        "start_line": idx + 1,
+                        "end_line": idx + 1,
+                        "signal": "regex_match",
+                        "snippet": compact_text(text[start:end]),
+                    }
+                )
+                if len(out) >= limit:
+                    return out
         return out
 
     def slice_text(self, text: Any, start: int = 0, end: Optional[int] = None) -> str:
@@ -739,12 +1312,11 @@ class SandboxEnvironment:
 
     def append_highlight(self, text: Any) -> None:
         value = compact_text(str(text), 240)
-        if not value:
+        if not value or value in self._highlight_set:
             return
-        if value not in self.highlights:
+        if len(self.highlights) < MAX_HIGHLIGHTS:
+            self._highlight_set.add(value)
             self.highlights.append(value)
-        if len(self.highlights) > MAX_HIGHLIGHTS:
-            self.highlights = self.highlights[:MAX_HIGHLIGHTS]
 
     def add_citation(
         self,
@@ -786,7 +1358,7 @@ class SandboxEnvironment:
         response = invoke_cli(self.subcall_cli, prompt_text, self.repo, timeout)
 
         preview = compact_text(response.get("stdout", ""), 180)
-        self.state.history.append(
+        self.state.record(
             {
                 "step": self.state.step_count,
                 "type": "subcall",
@@ -795,106 +1367,78 @@ class SandboxEnvironment:
                 "stdout_preview": preview,
             }
         )
-        if len(self.state.history) > 200:
-            self.state.history = self.state.history[-200:]
 
         if not response.get("ok"):
-            stderr = compact_text(response.get("stderr", ""), 220)
+            stderr = compact_text((response.get("stderr") or "")[:220], 220)
             raise ModelInvocationError(
                 f"subcall command failed (rc={response.get('returncode')}): {stderr or 'no stderr'}"
             )
         return response.get("stdout", "").strip()
 
-    def _validate_ast(self, code: str) -> ast.Module:
+    def sub_rlm_batch(self, prompts: Any, depth: int = 1) -> List[str]:
+        if isinstance(prompts, (str, bytes)):
+            raise SandboxViolation("sub_rlm_batch expects a list of prompts")
         try:
-            tree = ast.parse(code, mode="exec")
-        except SyntaxError as exc:
-            raise SandboxViolation(f"syntax error: {exc}") from exc
+            prompt_texts = [str(item)[:MAX_SUBCALL_PROMPT_CHARS] for item in prompts]
+        except TypeError as exc:
+            raise SandboxViolation("sub_rlm_batch expects a list of prompts") from exc
+        if not prompt_texts:
+            return []
+
+        # Charge the whole batch against the budget before dispatching any
+        # process, so limits fail fast instead of mid-flight.
+        for _ in prompt_texts:
+            self.state.next_subcall(depth)
+        timeout = self.state.remaining_timeout()
 
-        parent_map: Dict[ast.AST, ast.AST] = {}
-        for parent in ast.walk(tree):
-            for child in ast.iter_child_nodes(parent):
-                parent_map[child] = parent
+        async def run_all() -> List[Dict[str, Any]]:
+            semaphore = asyncio.Semaphore(MAX_PARALLEL_SUBCALLS)
 
-        defined_functions = {
-            node.name for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)
-        }
-        allowed_callables = set(SAFE_BUILTINS.keys()) | set(self._bindings.keys()) | defined_functions
+            async def one(prompt_text: str) -> Dict[str, Any]:
+                async with semaphore:
+                    return await _invoke_cli_async(
+                        self.subcall_cli, prompt_text, self.repo, timeout
+                    )
 
-        def is_allowed_method_call_target(attr_node: ast.Attribute) -> bool:
-            # Allow a narrow subset of non-dunder method calls used for
-            # container/string transformations in generated analysis code.
-            attr_name = attr_node.attr
-            if not attr_name or attr_name.startswith("__"):
-                return False
-            if attr_name not in SAFE_METHOD_CALLS:
-                return False
-            base = attr_node.value
-            if isinstance(base, ast.Name):
-                return not base.id.startswith("__")
-            if isinstance(base, ast.Constant):
-                return isinstance(base.value, str)
-            if isinstance(base, ast.Call):
-                # Allow chaining on outputs of approved helpers/safe builtins.
-                call_target = base.func
-                if isinstance(call_target, ast.Name):
-                    return call_target.id in allowed_callables
-                return False
-            return False
+            return await asyncio.gather(*(one(text) for text in prompt_texts))
 
-        def is_allowed_exception_handler_type(handler_type: ast.AST) -> bool:
-            if isinstance(handler_type, ast.Name):
-                return handler_type.id in SAFE_EXCEPTION_HANDLER_TYPES
-            if isinstance(handler_type, ast.Tuple):
-                if not handler_type.elts:
-                    return False
-                for item in handler_type.elts:
-                    if not isinstance(item, ast.Name):
-                        return False
-                    if item.id not in SAFE_EXCEPTION_HANDLER_TYPES:
-                        return False
-                return True
-            return False
+        responses = asyncio.run(run_all())
 
-        for node in ast.walk(tree):
-            if isinstance(node, (ast.Import, ast.ImportFrom, ast.With, ast.AsyncWith, ast.ClassDef, ast.Lambda, ast.Global, ast.Nonlocal, ast.Delete, ast.Raise, ast.Assert, ast.AsyncFunctionDef, ast.Await, ast.Yield, ast.YieldFrom, ast.Match)):
-                raise SandboxViolation(f"node type not allowed: {type(node).__name__}")
-            if not isinstance(node, ALLOWED_AST_NODES):
-                raise SandboxViolation(f"node type not allowed: {type(node).__name__}")
-            if isinstance(node, ast.ExceptHandler):
-                if node.type is None:
-                    raise SandboxViolation("bare except handlers are not allowed")
-                if not is_allowed_exception_handler_type(node.type):
-                    raise SandboxViolation("except handler type not allowed")
-                if node.name and node.name.startswith("__"):
-                    raise SandboxViolation("dunder exception handler names are not allowed")
-            if isinstance(node, ast.Attribute):
-                parent = parent_map.get(node)
-                if not (isinstance(parent, ast.Call) and parent.func is node and is_allowed_method_call_target(node)):
-                    raise SandboxViolation("attribute access is not allowed")
-            if isinstance(node, ast.Name) and node.id.startswith("__"):
-                raise SandboxViolation("dunder names are not allowed")
-            if isinstance(node, ast.Call):
-                if isinstance(node.func, ast.Name):
-                    if node.func.id not in allowed_callables:
-                        raise SandboxViolation(f"call target not allowed: {node.func.id}")
-                elif isinstance(node.func, ast.Attribute):
-                    if not is_allowed_method_call_target(node.func):
-                        raise SandboxViolation("method call target not allowed")
-                else:
-                    raise SandboxViolation("only direct or safe method calls are allowed")
-            if isinstance(node, ast.keyword) and node.arg and node.arg.startswith("__"):
-                raise SandboxViolation("dunder keyword args are not allowed")
+        outputs: List[str] = []
+        failure: Optional[str] = None
+        for response in responses:
+            self.state.record(
+                {
+                    "step": self.state.step_count,
+                    "type": "subcall",
+                    "returncode": response.get("returncode", -1),
+                    "duration_ms": response.get("duration_ms", 0),
+                    "stdout_preview": compact_text(response.get("stdout", ""), 180),
+                }
+            )
+            if not response.get("ok") and failure is None:
+                stderr = compact_text((response.get("stderr") or "")[:220], 220)
+                failure = (
+                    f"subcall command failed (rc={response.get('returncode')}): "
+                    f"{stderr or 'no stderr'}"
+                )
+            outputs.append(response.get("stdout", "").strip())
 
-        return tree
+        if failure is not None:
+            raise ModelInvocationError(failure)
+        return outputs
 
     def execute(self, code: str) -> Dict[str, Any]:
-        tree = self._validate_ast(code)
-        self._refresh_bindings()
+        code_obj = _compile_validated(code)
+        # Writes through the ChainMap land in user_locals, so any step that
+        # shadowed a helper name only masked it there; dropping the shadow
+        # restores the binding without rebuilding the table.
+        for name in SANDBOX_BINDING_NAMES.intersection(self.user_locals):
+            del self.user_locals[name]
 
         stdout_buffer = io.StringIO()
         with redirect_stdout(stdout_buffer):
-            exec(compile(tree, "<rlms-root>", "exec"), {"__builtins__": SAFE_BUILTINS}, self.locals)
+            exec(code_obj, {"__builtins__": SAFE_BUILTINS}, self.locals)
 
         stdout_text = stdout_buffer.getvalue()
         return {
@@ -904,19 +1448,169 @@ class SandboxEnvironment:
         }
 
 
+_STATIC_CALLABLES: frozenset[str] = frozenset(SAFE_BUILTINS) | SANDBOX_BINDING_NAMES
+
+# Exact-type allow list; ast nodes in generated code are never subclassed, so
+# a frozenset membership test replaces the linear isinstance scans (including
+# the old explicit ban tuple, which the allow list already subsumes).
+_ALLOWED_NODE_SET: frozenset = frozenset(ALLOWED_AST_NODES)
+
+
+def _is_allowed_method_call_target(
+    attr_node: ast.Attribute, deferred: List[Tuple[str, str]]
+) -> bool:
+    # Allow a narrow subset of non-dunder method calls used for
+    # container/string transformations in generated analysis code.
+    attr_name = attr_node.attr
+    if not attr_name or attr_name.startswith("__"):
+        return False
+    if attr_name not in SAFE_METHOD_CALLS:
+        return False
+    base = attr_node.value
+    if isinstance(base, ast.Name):
+        return not base.id.startswith("__")
+    if isinstance(base, ast.Constant):
+        return isinstance(base.value, str)
+    if isinstance(base, ast.Call):
+        # Allow chaining on outputs of approved helpers/safe builtins;
+        # user-defined functions resolve after the walk completes.
+        call_target = base.func
+        if isinstance(call_target, ast.Name):
+            if call_target.id not in _STATIC_CALLABLES:
+                deferred.append((call_target.id, "method call target not allowed"))
+            return True
+        return False
+    return False
+
+
+def _is_allowed_exception_handler_type(handler_type: ast.AST) -> bool:
+    if isinstance(handler_type, ast.Name):
+        return handler_type.id in SAFE_EXCEPTION_HANDLER_TYPES
+    if isinstance(handler_type, ast.Tuple):
+        if not handler_type.elts:
+            return False
+        for item in handler_type.elts:
+            if not isinstance(item, ast.Name):
+                return False
+            if item.id not in SAFE_EXCEPTION_HANDLER_TYPES:
+                return False
+        return True
+    return False
+
+
+def _check_except_handler(node, parent, defined, deferred) -> None:
+    if node.type is None:
+        raise SandboxViolation("bare except handlers are not allowed")
+    if not _is_allowed_exception_handler_type(node.type):
+        raise SandboxViolation("except handler type not allowed")
+    if node.name and node.name.startswith("__"):
+        raise SandboxViolation("dunder exception handler names are not allowed")
+
+
+def _check_attribute(node, parent, defined, deferred) -> None:
+    if not (
+        isinstance(parent, ast.Call)
+        and parent.func is node
+        and _is_allowed_method_call_target(node, deferred)
+    ):
+        raise SandboxViolation("attribute access is not allowed")
+
+
+def _check_name(node, parent, defined, deferred) -> None:
+    if node.id.startswith("__"):
+        raise SandboxViolation("dunder names are not allowed")
+
+
+def _check_call(node, parent, defined, deferred) -> None:
+    func = node.func
+    if isinstance(func, ast.Name):
+        if func.id not in _STATIC_CALLABLES:
+            deferred.append((func.id, f"call target not allowed: {func.id}"))
+    elif isinstance(func, ast.Attribute):
+        if not _is_allowed_method_call_target(func, deferred):
+            raise SandboxViolation("method call target not allowed")
+    else:
+        raise SandboxViolation("only direct or safe method calls are allowed")
+
+
+def _check_keyword(node, parent, defined, deferred) -> None:
+    if node.arg and node.arg.startswith("__"):
+        raise SandboxViolation("dunder keyword args are not allowed")
+
+
+def _check_function_def(node, parent, defined, deferred) -> None:
+    defined.add(node.name)
+
+
+_NODE_CHECKS: Dict[type, Any] = {
+    ast.ExceptHandler: _check_except_handler,
+    ast.Attribute: _check_attribute,
+    ast.Name: _check_name,
+    ast.Call: _check_call,
+    ast.keyword: _check_keyword,
+    ast.FunctionDef: _check_function_def,
+}
+
+
+def _validate_code(code: str) -> ast.Module:
+    try:
+        tree = ast.parse(code, mode="exec")
+    except SyntaxError as exc:
+        raise SandboxViolation(f"syntax error: {exc}") from exc
+
+    defined: set[str] = set()
+    # Call targets that may refer to functions defined later in the snippet;
+    # resolved once the whole tree has been walked.
+    deferred: List[Tuple[str, str]] = []
+
+    stack: List[Tuple[ast.AST, Optional[ast.AST]]] = [(tree, None)]
+    checks = _NODE_CHECKS
+    allowed = _ALLOWED_NODE_SET
+    while stack:
+        node, parent = stack.pop()
+        node_type = type(node)
+        if node_type not in allowed:
+            raise SandboxViolation(f"node type not allowed: {node_type.__name__}")
+        check = checks.get(node_type)
+        if check is not None:
+            check(node, parent, defined, deferred)
+        for child in ast.iter_child_nodes(node):
+            stack.append((child, node))
+
+    for name, message in deferred:
+        if name not in defined:
+            raise SandboxViolation(message)
+
+    return tree
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_validated(code: str):
+    """Validate and compile a generated snippet, memoized on the code string.
+
+    Validation depends only on module-level policy (SAFE_BUILTINS,
+    SANDBOX_BINDING_NAMES, the AST allow-list), so repeated or identical
+    snippets across steps skip both AST walks and the compile pass.
+    """
+    return compile(_validate_code(code), "<rlms-root>", "exec")
+
+
 def merge_highlights(final_value: Any, sandbox_highlights: Sequence[str], fallback_signals: Dict[str, int], file_count: int) -> List[str]:
     out: List[str] = []
+    seen: set[str] = set()
 
     if isinstance(final_value, dict):
         raw = final_value.get("highlights", [])
         if isinstance(raw, list):
             for item in raw:
                 value = compact_text(str(item), 240)
-                if value and value not in out:
+                if value and value not in seen:
+                    seen.add(value)
                     out.append(value)
 
     for item in sandbox_highlights:
-        if item and item not in out:
+        if item and item not in seen:
+            seen.add(item)
             out.append(item)
 
     if not out:
@@ -932,40 +1626,40 @@ def merge_highlights(final_value: Any, sandbox_highlights: Sequence[str], fallba
 
 
 def merge_citations(final_value: Any, sandbox_citations: Sequence[Dict[str, Any]], fallback_citations: Sequence[Dict[str, Any]], require_citations: bool, docs: Sequence[Document]) -> List[Dict[str, Any]]:
-    items: List[Dict[str, Any]] = []
+    def normalized(source: Iterable[Any]) -> Iterable[Dict[str, Any]]:
+        for item in source:
+            citation = normalize_citation(item)
+            if citation is not None:
+                yield citation
 
+    explicit: List[Any] = []
     if isinstance(final_value, dict):
         raw = final_value.get("citations", [])
         if isinstance(raw, list):
-            for item in raw:
-                citation = normalize_citation(item)
-                if citation is not None:
-                    items.append(citation)
+            explicit = raw
 
-    for item in sandbox_citations:
-        citation = normalize_citation(item)
-        if citation is not None:
-            items.append(citation)
+    # Dedupe lazily so normalization stops as soon as MAX_CITATIONS unique
+    # entries exist, instead of materializing every candidate first.
+    items = dedupe_citations(
+        normalized(itertools.chain(explicit, sandbox_citations))
+    )
 
     if not items:
-        for item in fallback_citations[:MAX_CITATIONS]:
-            citation = normalize_citation(item)
-            if citation is not None:
-                items.append(citation)
+        items = dedupe_citations(normalized(fallback_citations))
 
     if require_citations and not items:
-        for doc in docs[:8]:
-            items.append(
-                {
-                    "path": doc.path,
-                    "start_line": 1,
-                    "end_line": 1,
-                    "signal": "file_reference",
-                    "snippet": "Fallback citation generated because no explicit citation was produced",
-                }
-            )
+        items = [
+            {
+                "path": doc.path,
+                "start_line": 1,
+                "end_line": 1,
+                "signal": "file_reference",
+                "snippet": "Fallback citation generated because no explicit citation was produced",
+            }
+            for doc in docs[:8]
+        ]
 
-    return dedupe_citations(items)
+    return items
 
 
 def parse_args() -> argparse.Namespace:
@@ -994,6 +1688,60 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+# Exception -> (error_code, exit_code). Resolution walks the MRO so a
+# subclass maps like its parent, preserving the semantics of the former
+# except ladder; anything unlisted is a generic worker failure.
+_ERROR_CODES = {
+    LimitError: ("limit_exceeded", 2),
+    SandboxViolation: ("sandbox_violation", 1),
+    ModelInvocationError: ("model_invocation_failed", 1),
+}
+
+# Failure payload layout; fixed so every handler serializes an identical
+# key order regardless of how the dict gets populated.
+_ERR_KEYS = (
+    "ok",
+    "generated_at",
+    "loop_id",
+    "role",
+    "iteration",
+    "error",
+    "error_code",
+    "stats",
+    "trace",
+    "metadata",
+)
+
+
+def _emit_error(
+    error_code: str,
+    exc: BaseException,
+    *,
+    args: argparse.Namespace,
+    state: ExecutionState,
+    metadata: Dict[str, Any],
+    rc: int,
+) -> int:
+    """Build, emit, and rc-code one failure result; shared by all handlers."""
+    result = dict.fromkeys(_ERR_KEYS)
+    result["ok"] = False
+    result["generated_at"] = utc_now()
+    result["loop_id"] = args.loop_id
+    result["role"] = args.role
+    result["iteration"] = args.iteration
+    result["error"] = str(exc)
+    result["error_code"] = error_code
+    result["stats"] = {
+        "step_count": state.step_count,
+        "subcall_count": state.subcall_count,
+        "elapsed_seconds": round(state.elapsed_seconds(), 3),
+    }
+    result["trace"] = list(state.trace_tail)
+    result["metadata"] = metadata or None
+    _emit_json(result)
+    return rc
+
+
 def main() -> int:
     args = parse_args()
     os.makedirs(args.output_dir, exist_ok=True)
@@ -1007,21 +1755,17 @@ def main() -> int:
         sub_command = parse_json_string_array("subcall_command_json", args.subcall_command_json)
         sub_args = parse_json_string_array("subcall_args_json", args.subcall_args_json)
     except RLMSWorkerError as exc:
-        print(
-            json.dumps(
-                {
-                    "ok": False,
-                    "generated_at": utc_now(),
-                    "loop_id": args.loop_id,
-                    "role": args.role,
-                    "iteration": args.iteration,
-                    "error": str(exc),
-                    "error_code": "invalid_config",
-                    "metadata": metadata or None,
-                },
-                separators=(",", ":"),
-                ensure_ascii=True,
-            )
+        _emit_json(
+            {
+                "ok": False,
+                "generated_at": utc_now(),
+                "loop_id": args.loop_id,
+                "role": args.role,
+                "iteration": args.iteration,
+                "error": str(exc),
+                "error_code": "invalid_config",
+                "metadata": metadata or None,
+            }
         )
         return 2
 
@@ -1039,7 +1783,7 @@ def main() -> int:
             "error_code": "missing_root_command",
             "metadata": metadata or None,
         }
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
+        _emit_json(result)
         return 2
 
     if not sub_command:
@@ -1050,59 +1794,87 @@ def main() -> int:
     root_cli = CliConfig(command=root_command, args=root_args, prompt_mode=root_prompt_mode, label="root")
     sub_cli = CliConfig(command=sub_command, args=sub_args, prompt_mode=sub_prompt_mode, label="subcall")
 
-    configured_max_subcalls = int(args.max_subcalls or 0)
+    # argparse already coerced the limit flags with type=int; only clamping
+    # remains here.
+    configured_max_subcalls = args.max_subcalls
     if configured_max_subcalls <= 0:
-        configured_max_subcalls = max(1, int(args.max_steps) * 2)
+        configured_max_subcalls = max(1, args.max_steps * 2)
 
     state = ExecutionState(
         started_at_monotonic=time.monotonic(),
-        max_steps=max(1, int(args.max_steps)),
-        max_depth=max(1, int(args.max_depth)),
-        timeout_seconds=max(1, int(args.timeout_seconds)),
+        max_steps=max(1, args.max_steps),
+        max_depth=max(1, args.max_depth),
+        timeout_seconds=max(1, args.timeout_seconds),
         max_subcalls=max(1, configured_max_subcalls),
     )
 
     require_citations = parse_bool(args.require_citations)
-    total_chars = sum(doc.char_count for doc in docs)
-    total_lines = sum(doc.line_count for doc in docs)
+    total_chars = 0
+    total_lines = 0
+    for doc in docs:
+        total_chars += doc.char_count
+        total_lines += doc.line_count
     structural_signals, structural_citations = collect_structural_signals(docs)
 
+    # Fixed for the lifetime of the run; built once instead of per exit.
+    limits = {
+        "max_steps": state.max_steps,
+        "max_depth": state.max_depth,
+        "timeout_seconds": state.timeout_seconds,
+        "max_subcalls": state.max_subcalls,
+    }
+    doc_stats = {
+        "file_count": len(docs),
+        "line_count": total_lines,
+        "char_count": total_chars,
+        "estimated_tokens": estimate_tokens(total_chars),
+    }
+
     sandbox = SandboxEnvironment(docs=docs, state=state, subcall_cli=sub_cli, repo=args.repo)
 
+    # Bind loop invariants once; the attribute chains otherwise re-resolve on
+    # every iteration.
+    tick_step = state.tick_step
+    remaining_timeout = state.remaining_timeout
+    record = state.record
+    execute = sandbox.execute
+    repo = args.repo
+
+    prompt_prefix = build_root_prompt_prefix(
+        role=args.role,
+        loop_id=args.loop_id,
+        iteration=args.iteration,
+        docs=docs,
+        metadata=metadata,
+        state=state,
+    )
+
     try:
         while sandbox.final_value is None:
-            state.tick_step()
-            prompt = build_root_prompt(
-                role=args.role,
-                loop_id=args.loop_id,
-                iteration=args.iteration,
-                docs=docs,
-                metadata=metadata,
-                state=state,
-            )
+            tick_step()
+            prompt = build_root_prompt(prefix=prompt_prefix, state=state)
 
-            response = invoke_cli(root_cli, prompt, args.repo, state.remaining_timeout())
-            if not response.get("ok"):
-                stderr = compact_text(response.get("stderr", ""), 260)
+            response = invoke_cli(root_cli, prompt, repo, remaining_timeout())
+            rget = response.get
+            if not rget("ok"):
+                stderr = compact_text((rget("stderr") or "")[:260], 260)
                 raise ModelInvocationError(
-                    f"root command failed (rc={response.get('returncode')}): {stderr or 'no stderr'}"
+                    f"root command failed (rc={rget('returncode')}): {stderr or 'no stderr'}"
                 )
 
-            code = extract_python_code(str(response.get("stdout", "")))
-            execution = sandbox.execute(code)
+            code = extract_python_code(str(rget("stdout", "")))
+            execution = execute(code)
 
-            state.history.append(
+            record(
                 {
                     "step": state.step_count,
                     "type": "root",
-                    "returncode": int(response.get("returncode", 0)),
-                    "duration_ms": int(response.get("duration_ms", 0)),
+                    "returncode": int(rget("returncode", 0)),
+                    "duration_ms": int(rget("duration_ms", 0)),
                     "code_preview": execution.get("code_preview", ""),
                     "stdout_preview": execution.get("stdout_preview", ""),
                 }
             )
-            if len(state.history) > 200:
-                state.history = state.history[-200:]
 
             if sandbox.final_value is None and state.step_count >= state.max_steps:
                 raise LimitError("final value was not set before max_steps")
@@ -1123,17 +1895,9 @@ def main() -> int:
             "role": args.role,
             "iteration": args.iteration,
             "format": args.format,
-            "limits": {
-                "max_steps": int(args.max_steps),
-                "max_depth": int(args.max_depth),
-                "timeout_seconds": int(args.timeout_seconds),
-                "max_subcalls": state.max_subcalls,
-            },
+            "limits": limits,
             "stats": {
-                "file_count": len(docs),
-                "line_count": total_lines,
-                "char_count": total_chars,
-                "estimated_tokens": estimate_tokens(total_chars),
+                **doc_stats,
                 "step_count": state.step_count,
                 "subcall_count": state.subcall_count,
                 "elapsed_seconds": round(state.elapsed_seconds(), 3),
@@ -1142,89 +1906,23 @@ def main() -> int:
             "highlights": highlights,
             "citations": citations,
             "files": build_file_summaries(docs),
-            "trace": state.history[-MAX_HISTORY_ITEMS:],
+            "trace": list(state.trace_tail),
             "final": sandbox.final_value,
             "metadata": metadata or None,
         }
 
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
+        _emit_json(result)
         return 0
-    except LimitError as exc:
-        result = {
-            "ok": False,
-            "generated_at": utc_now(),
-            "loop_id": args.loop_id,
-            "role": args.role,
-            "iteration": args.iteration,
-            "error": str(exc),
-            "error_code": "limit_exceeded",
-            "stats": {
-                "step_count": state.step_count,
-                "subcall_count": state.subcall_count,
-                "elapsed_seconds": round(state.elapsed_seconds(), 3),
-            },
-            "trace": state.history[-MAX_HISTORY_ITEMS:],
-            "metadata": metadata or None,
-        }
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
-        return 2
-    except SandboxViolation as exc:
-        result = {
-            "ok": False,
-            "generated_at": utc_now(),
-            "loop_id": args.loop_id,
-            "role": args.role,
-            "iteration": args.iteration,
-            "error": str(exc),
-            "error_code": "sandbox_violation",
-            "stats": {
-                "step_count": state.step_count,
-                "subcall_count": state.subcall_count,
-                "elapsed_seconds": round(state.elapsed_seconds(), 3),
-            },
-            "trace": state.history[-MAX_HISTORY_ITEMS:],
-            "metadata": metadata or None,
-        }
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
-        return 1
-    except ModelInvocationError as exc:
-        result = {
-            "ok": False,
-            "generated_at": utc_now(),
-            "loop_id": args.loop_id,
-            "role": args.role,
-            "iteration": args.iteration,
-            "error": str(exc),
-            "error_code": "model_invocation_failed",
-            "stats": {
-                "step_count": state.step_count,
-                "subcall_count": state.subcall_count,
-                "elapsed_seconds": round(state.elapsed_seconds(), 3),
-            },
-            "trace": state.history[-MAX_HISTORY_ITEMS:],
-            "metadata": metadata or None,
-        }
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
-        return 1
-    except Exception as exc:  # pragma: no cover - defensive path
-        result = {
-            "ok": False,
-            "generated_at": utc_now(),
-            "loop_id": args.loop_id,
-            "role": args.role,
-            "iteration": args.iteration,
-            "error": str(exc),
-            "error_code": "worker_failure",
-            "stats": {
-                "step_count": state.step_count,
-                "subcall_count": state.subcall_count,
-                "elapsed_seconds": round(state.elapsed_seconds(), 3),
-            },
-            "trace": state.history[-MAX_HISTORY_ITEMS:],
-            "metadata": metadata or None,
-        }
-        print(json.dumps(result, separators=(",", ":"), ensure_ascii=True))
-        return 1
+    except (SandboxViolation, Exception) as exc:
+        # SandboxViolation derives from BaseException precisely so sandboxed
+        # code cannot swallow it; it must be named here to be caught at all.
+        for klass in type(exc).__mro__:
+            if klass in _ERROR_CODES:
+                error_code, rc = _ERROR_CODES[klass]
+                break
+        else:  # pragma: no cover - defensive path
+            error_code, rc = "worker_failure", 1
+        return _emit_error(error_code, exc, args=args, state=state, metadata=metadata, rc=rc)
 
 
 if __name__ == "__main__":
@@ -178,6 +178,53 @@ PY
 EOF
   chmod +x "$ROOT_TRY_CATCH_SANDBOX_LLM"
 
+  ROOT_BATCH_LLM="$TEMP_DIR/mock-root-batch.sh"
+  cat > "$ROOT_BATCH_LLM" <<'EOF'
+#!/usr/bin/env bash
+set -euo pipefail
+cat >/dev/null
+cat <<'PY'
+results = sub_rlm_batch(["alpha", "beta", "gamma"], depth=1)
+append_highlight("batch:" + "|".join(results))
+set_final({"highlights": ["batch_complete"], "citations": []})
+PY
+EOF
+  chmod +x "$ROOT_BATCH_LLM"
+
+  ROOT_BATCH_FAIL_LLM="$TEMP_DIR/mock-root-batch-fail.sh"
+  cat > "$ROOT_BATCH_FAIL_LLM" <<'EOF'
+#!/usr/bin/env bash
+set -euo pipefail
+cat >/dev/null
+cat <<'PY'
+sub_rlm_batch(["good prompt", "bad prompt"], depth=1)
+set_final({"highlights": ["should_not_complete"], "citations": []})
+PY
+EOF
+  chmod +x "$ROOT_BATCH_FAIL_LLM"
+
+  SUBCALL_ECHO_LLM="$TEMP_DIR/mock-subcall-echo.sh"
+  cat > "$SUBCALL_ECHO_LLM" <<'EOF'
+#!/usr/bin/env bash
+set -euo pipefail
+payload="$(cat)"
+echo "got:${payload}"
+EOF
+  chmod +x "$SUBCALL_ECHO_LLM"
+
+  SUBCALL_PARTIAL_FAIL_LLM="$TEMP_DIR/mock-subcall-partial-fail.sh"
+  cat > "$SUBCALL_PARTIAL_FAIL_LLM" <<'EOF'
+#!/usr/bin/env bash
+set -euo pipefail
+payload="$(cat)"
+if [[ "$payload" == *bad* ]]; then
+  echo "forced batch subcall failure" >&2
+  exit 3
+fi
+echo "ok"
+EOF
+  chmod +x "$SUBCALL_PARTIAL_FAIL_LLM"
+
   SUBCALL_SUCCESS_LLM="$TEMP_DIR/mock-subcall-success.sh"
   cat > "$SUBCALL_SUCCESS_LLM" <<'EOF'
 #!/usr/bin/env bash
@@ -561,6 +608,90 @@ EOF
   [[ "$output" =~ "subcall limit exceeded" ]]
 }
 
+@test "rlms REPL worker runs sub_rlm_batch and keeps outputs in prompt order" {
+  local context_file_list="$TEMP_DIR/context-files.txt"
+  printf '%s\n' "$SAMPLE_CONTEXT_FILE" > "$context_file_list"
+  local output_dir="$TEMP_DIR/rlms-batch-success"
+  local root_command_json
+  root_command_json=$(jq -cn --arg cmd "$ROOT_BATCH_LLM" '[$cmd]')
+  local subcall_command_json
+  subcall_command_json=$(jq -cn --arg cmd "$SUBCALL_ECHO_LLM" '[$cmd]')
+
+  run "$PROJECT_ROOT/scripts/rlms" \
+    --repo "$TEMP_DIR" \
+    --loop-id rlms-loop \
+    --role reviewer \
+    --iteration 1 \
+    --context-file-list "$context_file_list" \
+    --output-dir "$output_dir" \
+    --max-steps 5 \
+    --max-depth 2 \
+    --timeout-seconds 60 \
+    --root-command-json "$root_command_json" \
+    --root-args-json '[]' \
+    --root-prompt-mode stdin \
+    --subcall-command-json "$subcall_command_json" \
+    --subcall-args-json '[]' \
+    --subcall-prompt-mode stdin \
+    --require-citations true \
+    --format json
+  [ "$status" -eq 0 ]
+
+  run jq -r '.ok' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [ "$output" = "true" ]
+
+  run jq -r '.stats.subcall_count // 0' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [ "$output" -eq 3 ]
+
+  run jq -r '.highlights[]' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [[ "$output" =~ "batch:got:alpha|got:beta|got:gamma" ]]
+}
+
+@test "rlms REPL worker fails the batch when one subcall fails" {
+  local context_file_list="$TEMP_DIR/context-files.txt"
+  printf '%s\n' "$SAMPLE_CONTEXT_FILE" > "$context_file_list"
+  local output_dir="$TEMP_DIR/rlms-batch-fail"
+  local root_command_json
+  root_command_json=$(jq -cn --arg cmd "$ROOT_BATCH_FAIL_LLM" '[$cmd]')
+  local subcall_command_json
+  subcall_command_json=$(jq -cn --arg cmd "$SUBCALL_PARTIAL_FAIL_LLM" '[$cmd]')
+
+  run "$PROJECT_ROOT/scripts/rlms" \
+    --repo "$TEMP_DIR" \
+    --loop-id rlms-loop \
+    --role reviewer \
+    --iteration 1 \
+    --context-file-list "$context_file_list" \
+    --output-dir "$output_dir" \
+    --max-steps 5 \
+    --max-depth 2 \
+    --timeout-seconds 60 \
+    --root-command-json "$root_command_json" \
+    --root-args-json '[]' \
+    --root-prompt-mode stdin \
+    --subcall-command-json "$subcall_command_json" \
+    --subcall-args-json '[]' \
+    --subcall-prompt-mode stdin \
+    --require-citations true \
+    --format json
+  [ "$status" -ne 0 ]
+
+  run jq -r '.error_code' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [ "$output" = "model_invocation_failed" ]
+
+  run jq -r '.error' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [[ "$output" =~ "subcall command failed" ]]
+
+  run jq -r '.stats.subcall_count // 0' "$output_dir/result.json"
+  [ "$status" -eq 0 ]
+  [ "$output" -eq 2 ]
+}
+
 @test "rlms superloop path supports root/subcall env overrides with real artifacts" {
   write_loop_config "auto" "warn_and_continue" "true" 999999 999999 "NOT_PRESENT"
 